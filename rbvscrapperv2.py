@@ -5,6 +5,12 @@ import random
 import json
 import subprocess
 import sys
+import asyncio
+import hashlib
+import io
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from enum import Enum
@@ -19,12 +25,38 @@ class Config:
     BASE_URL = "https://pustaka.ut.ac.id/reader/services/view.php"
     REFERER_BASE = "https://pustaka.ut.ac.id/reader/index.php"
     TIMEOUT = 30
+    CHUNK_SIZE = 64 * 1024  # Bytes read per streamed chunk
+    PROGRESS_SAVE_INTERVAL = 10  # Seconds between manifest saves while streaming
+    PART_SUFFIX = ".part"  # Partial downloads kept for Range resume
+    POOL_SIZE = 10  # Connections kept per host in a shared session
+    SHARED_CACHE = None  # Shared page cache: directory path or http(s):// peer URL
+    SHARED_CACHE_MAX_BYTES = 2 * 1024 ** 3  # LRU eviction bound for directory caches
+    SHARED_CACHE_SCAN_INTERVAL = 200  # Puts between full rescans of a directory cache
+    SHARED_CACHE_TIMEOUT = 3  # Seconds to wait for a peer cache
+    SHARED_CACHE_RETRY_INTERVAL = 60  # Seconds to skip an unreachable peer
     MIN_DELAY = 10
     MAX_DELAY = 20
     MANIFEST_SUFFIX = ".manifest.json"
     DOC_PADDING = 2  # M01, M02, etc.
     PAGE_PADDING = 3  # 001, 002, etc.
     IMAGE_FORMAT = "jpg"  # Expected format
+    NEGOTIATE_FORMAT = False  # Probe the server and fetch the smallest format
+    CANDIDATE_FORMATS = ["webp", "png", "jpg"]  # Formats tried when negotiating
+    TRANSCODE_WORKERS = 2  # Background threads converting pages to IMAGE_FORMAT
+    TRANSCODE_QUALITY = 90
+    PDF_LINEARIZE = False  # Write "fast web view" PDFs (needs pikepdf)
+    PDF_SKIP_BLANK = False  # Leave pages flagged blank out of the PDF
+    PDF_AUTO_CROP = False  # Crop PDF pages to their content box (visual only, see below)
+    PDF_CROP_REENCODE = False  # Really crop the image data; re-encodes cropped pages
+    CROP_REENCODE_MIN_AREA = 0.15  # Only re-encode when cropping removes this much of a page
+    
+    # Page analysis (needs numpy)
+    ANALYSIS_BATCH_SIZE = 32  # Pages loaded per array batch
+    ANALYSIS_SIZE = (256, 256)  # Downsampled (width, height) used for analysis
+    INK_THRESHOLD = 200  # Gray levels below this count as content
+    BLANK_INK_RATIO = 0.002  # Pages with less content than this are blank
+    CROP_MIN_PIXELS = 4  # Dark pixels a row/column needs at ANALYSIS_SIZE to count as content
+    CROP_MARGIN = 0.02  # Padding kept around content, as a fraction of the page
     
     # Cookies - Update these with your actual values
     COOKIES = {
@@ -40,6 +72,9 @@ class Config:
     }
 
 
+PIL_FORMATS = {"jpg": "JPEG", "png": "PNG", "gif": "GIF", "webp": "WEBP"}
+
+
 class DownloadStatus(Enum):
     """Download status enumeration"""
     PENDING = "pending"
@@ -57,10 +92,12 @@ class DownloadStatus(Enum):
 class ManifestManager:
     """Manage manifest file for download tracking and resume"""
     
-    def __init__(self, module_name):
+    def __init__(self, module_name, output_dir=None):
         self.module_name = module_name
-        self.manifest_path = Path(module_name) / f"{module_name}{Config.MANIFEST_SUFFIX}"
+        self.output_dir = Path(output_dir) if output_dir is not None else Path(module_name)
+        self.manifest_path = self.output_dir / f"{module_name}{Config.MANIFEST_SUFFIX}"
         self.manifest_data = None
+        self._lock = threading.RLock()
     
     def create_manifest(self, docs_pages):
         """Create a new manifest file"""
@@ -71,6 +108,8 @@ class ManifestManager:
                 "updated_at": datetime.now().isoformat(),
                 "num_docs": len(docs_pages),
                 "total_pages": sum(docs_pages.values()),
+                "source_format": Config.IMAGE_FORMAT,
+                "target_format": Config.IMAGE_FORMAT,
                 "docs_info": {
                     f"M{i}": docs_pages[f"M{i}"]
                     for i in range(1, len(docs_pages) + 1)
@@ -99,7 +138,9 @@ class ManifestManager:
                     "attempts": 0,
                     "last_error": None,
                     "actual_format": None,
-                    "completed_at": None
+                    "validator": None,
+                    "completed_at": None,
+                    "transcoded_at": None
                 }
         
         self._save_manifest()
@@ -120,34 +161,146 @@ class ManifestManager:
     
     def _save_manifest(self):
         """Save manifest to file"""
-        self.manifest_data["metadata"]["updated_at"] = datetime.now().isoformat()
-        Path(self.module_name).mkdir(exist_ok=True)
-        
-        with open(self.manifest_path, 'w') as f:
-            json.dump(self.manifest_data, f, indent=2)
+        with self._lock:
+            self.manifest_data["metadata"]["updated_at"] = datetime.now().isoformat()
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            
+            # Write a temp file first so an interruption never truncates the manifest
+            temp_path = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+            with open(temp_path, 'w') as f:
+                json.dump(self.manifest_data, f, indent=2)
+            os.replace(temp_path, self.manifest_path)
     
     def update_file_status(self, filename, status, size=None, error=None, actual_format=None):
         """Update file download status"""
-        if filename in self.manifest_data["files"]:
-            self.manifest_data["files"][filename]["status"] = status.value
-            self.manifest_data["files"][filename]["attempts"] += 1
-            
-            if size is not None:
-                self.manifest_data["files"][filename]["size"] = size
-                self.manifest_data["files"][filename]["downloaded_size"] = size
-                self.manifest_data["files"][filename]["progress_percent"] = 100
-            
-            if error:
-                self.manifest_data["files"][filename]["last_error"] = error
-            
-            if actual_format:
-                self.manifest_data["files"][filename]["actual_format"] = actual_format
+        with self._lock:
+            if filename in self.manifest_data["files"]:
+                self.manifest_data["files"][filename]["status"] = status.value
+                self.manifest_data["files"][filename]["attempts"] += 1
+                
+                if size is not None:
+                    self.manifest_data["files"][filename]["size"] = size
+                    self.manifest_data["files"][filename]["downloaded_size"] = size
+                    self.manifest_data["files"][filename]["progress_percent"] = 100
+                
+                if error:
+                    self.manifest_data["files"][filename]["last_error"] = error
+                
+                if actual_format:
+                    self.manifest_data["files"][filename]["actual_format"] = actual_format
+                
+                if status == DownloadStatus.COMPLETED:
+                    self.manifest_data["files"][filename]["completed_at"] = datetime.now().isoformat()
+                    self.manifest_data["files"][filename].pop("analysis", None)
+                
+                self._save_manifest()
+    
+    def update_file_progress(self, filename, downloaded_size, total_size=None, validator=None):
+        """Record bytes received so far for a partial download"""
+        with self._lock:
+            if filename in self.manifest_data["files"]:
+                file_info = self.manifest_data["files"][filename]
+                file_info["status"] = DownloadStatus.DOWNLOADING.value
+                file_info["downloaded_size"] = downloaded_size
+                total_size = total_size or file_info["size"]
+                
+                if total_size:
+                    file_info["size"] = total_size
+                    file_info["progress_percent"] = int(downloaded_size * 100 / total_size)
+                
+                if validator:
+                    file_info["validator"] = validator
+                
+                self._save_manifest()
+    
+    def mark_transcoded(self, filename):
+        """Record that a page has been converted to the target format"""
+        with self._lock:
+            if filename in self.manifest_data["files"]:
+                self.manifest_data["files"][filename]["transcoded_at"] = datetime.now().isoformat()
+                self._save_manifest()
+    
+    def record_cache_lookup(self, filename, hit, size=0):
+        """Count a shared cache hit or miss for a page"""
+        with self._lock:
+            stats = self.manifest_data["metadata"].setdefault(
+                "cache_stats", {"hits": 0, "misses": 0, "bytes_from_cache": 0}
+            )
+            if hit:
+                stats["hits"] += 1
+                stats["bytes_from_cache"] += size
+            else:
+                stats["misses"] += 1
             
-            if status == DownloadStatus.COMPLETED:
-                self.manifest_data["files"][filename]["completed_at"] = datetime.now().isoformat()
+            if filename in self.manifest_data["files"]:
+                self.manifest_data["files"][filename]["cache_hit"] = hit
             
             self._save_manifest()
     
+    def set_analysis(self, results):
+        """Store page analysis results keyed by filename"""
+        with self._lock:
+            for filename, analysis in results.items():
+                if filename in self.manifest_data["files"]:
+                    self.manifest_data["files"][filename]["analysis"] = analysis
+            self._save_manifest()
+    
+    def get_unanalyzed_files(self):
+        """Get completed pages without stored analysis"""
+        if not self.manifest_data:
+            return []
+        
+        return [
+            fname for fname, info in self.manifest_data["files"].items()
+            if info["status"] == DownloadStatus.COMPLETED.value
+            and "analysis" not in info
+        ]
+    
+    def get_source_format(self):
+        """Get the format requested from the server for this module"""
+        return self.manifest_data["metadata"].get("source_format", Config.IMAGE_FORMAT)
+    
+    def set_source_format(self, source_format, probe_sizes=None):
+        """Record the negotiated server format and probe results"""
+        with self._lock:
+            metadata = self.manifest_data["metadata"]
+            metadata["source_format"] = source_format
+            metadata["target_format"] = Config.IMAGE_FORMAT
+            if probe_sizes is not None:
+                metadata["format_probe"] = probe_sizes
+            self._save_manifest()
+    
+    def needs_transcode(self):
+        """Check if pages are fetched in a format other than the target"""
+        return self.get_source_format() != Config.IMAGE_FORMAT
+    
+    def get_page_format(self, filename):
+        """Get the format a page was fetched in, or will be fetched in if not completed"""
+        file_info = self.manifest_data["files"].get(filename, {})
+        if file_info.get("status") == DownloadStatus.COMPLETED.value and file_info.get("actual_format"):
+            return file_info["actual_format"]
+        return self.get_source_format()
+    
+    def get_source_filename(self, filename):
+        """Get the on-disk name of a page as fetched from the server"""
+        page_format = self.get_page_format(filename)
+        if page_format == Config.IMAGE_FORMAT:
+            return filename
+        return f"{Path(filename).stem}.{page_format}"
+    
+    def get_untranscoded_files(self):
+        """Get completed pages still waiting for conversion to the target format"""
+        if not self.manifest_data:
+            return []
+        
+        # Pages completed before a format switch keep their own format
+        return [
+            fname for fname, info in self.manifest_data["files"].items()
+            if info["status"] == DownloadStatus.COMPLETED.value
+            and not info.get("transcoded_at")
+            and self.get_page_format(fname) != Config.IMAGE_FORMAT
+        ]
+    
     def get_download_progress(self):
         """Get overall download progress"""
         if not self.manifest_data:
@@ -163,7 +316,7 @@ class ManifestManager:
         return (completed / total * 100) if total > 0 else 0
     
     def get_pending_files(self):
-        """Get list of pending, failed, or format_mismatch files"""
+        """Get list of pending, interrupted, failed, or format_mismatch files"""
         if not self.manifest_data:
             return []
         
@@ -171,6 +324,7 @@ class ManifestManager:
             fname for fname, info in self.manifest_data["files"].items()
             if info["status"] in [
                 DownloadStatus.PENDING.value,
+                DownloadStatus.DOWNLOADING.value,
                 DownloadStatus.FAILED.value,
                 DownloadStatus.FORMAT_MISMATCH.value
             ]
@@ -191,9 +345,20 @@ class ManifestManager:
         
         missing_files = []
         format_mismatches = []
+        lost_transcodes = []
         
         for filename, file_info in self.manifest_data["files"].items():
             filepath = output_dir / filename
+            expected_format = Config.IMAGE_FORMAT
+            
+            # A fetched page not yet transcoded only exists in its source format
+            source_filename = self.get_source_filename(filename)
+            if not filepath.exists() and source_filename != filename:
+                filepath = output_dir / source_filename
+                expected_format = self.get_page_format(filename)
+                if file_info.get("transcoded_at"):
+                    lost_transcodes.append(filename)
+                    file_info["transcoded_at"] = None
             
             if not filepath.exists():
                 missing_files.append(filename)
@@ -203,7 +368,6 @@ class ManifestManager:
                 
                 # Check file format
                 actual_format = self._get_file_format(filepath)
-                expected_format = Config.IMAGE_FORMAT
                 
                 if actual_format and actual_format.lower() != expected_format.lower():
                     format_mismatches.append((filename, expected_format, actual_format))
@@ -216,7 +380,7 @@ class ManifestManager:
                         self.manifest_data["files"][filename]["progress_percent"] = 100
                         self.manifest_data["files"][filename]["status"] = DownloadStatus.COMPLETED.value
         
-        if missing_files or format_mismatches:
+        if missing_files or format_mismatches or lost_transcodes:
             self._save_manifest()
         
         return len(missing_files) == 0 and len(format_mismatches) == 0
@@ -226,28 +390,31 @@ class ManifestManager:
         """Detect actual file format by reading magic bytes"""
         try:
             with open(filepath, 'rb') as f:
-                magic = f.read(12)
-                
-                # JPEG signatures
-                if magic[:2] == b'\xff\xd8':
-                    return 'jpg'
-                # PNG signature
-                elif magic[:8] == b'\x89PNG\r\n\x1a\n':
-                    return 'png'
-                # GIF signature
-                elif magic[:6] in [b'GIF87a', b'GIF89a']:
-                    return 'gif'
-                # PDF signature
-                elif magic[:4] == b'%PDF':
-                    return 'pdf'
-                # WEBP signature
-                elif magic[:4] == b'RIFF' and magic[8:12] == b'WEBP':
-                    return 'webp'
-                else:
-                    return None
+                return ManifestManager._detect_format(f.read(12))
         except:
             return None
     
+    @staticmethod
+    def _detect_format(magic):
+        """Detect format from the first 12 bytes of a file"""
+        # JPEG signatures
+        if magic[:2] == b'\xff\xd8':
+            return 'jpg'
+        # PNG signature
+        elif magic[:8] == b'\x89PNG\r\n\x1a\n':
+            return 'png'
+        # GIF signature
+        elif magic[:6] in [b'GIF87a', b'GIF89a']:
+            return 'gif'
+        # PDF signature
+        elif magic[:4] == b'%PDF':
+            return 'pdf'
+        # WEBP signature
+        elif magic[:4] == b'RIFF' and magic[8:12] == b'WEBP':
+            return 'webp'
+        else:
+            return None
+    
     def _get_filename(self, doc_padded, page_padded):
         """Generate filename based on naming scheme"""
         return f"{self.module_name}_{doc_padded}_{page_padded}.{Config.IMAGE_FORMAT}"
@@ -356,12 +523,12 @@ def handle_existing_module(module_name):
                 if format_issues:
                     print(f"\n⚠ Found {len(format_issues)} file(s) with format mismatch:")
                     for fname, info in format_issues[:3]:
-                        print(f"   - {fname}: expected {Config.IMAGE_FORMAT}, got {info.get('actual_format')}")
+                        print(f"   - {fname}: expected {manifest_mgr.get_source_format()}, got {info.get('actual_format')}")
                     
                     choice = input("\nDo you want to see these files or re-download them? (view/redownload/ignore): ").strip().lower()
                     if choice == "view":
                         for fname, info in format_issues:
-                            fpath = output_dir / fname
+                            fpath = output_dir / manifest_mgr.get_source_filename(fname)
                             if fpath.exists():
                                 try:
                                     if sys.platform == 'win32':
@@ -408,6 +575,174 @@ def handle_existing_module(module_name):
             return "cancel", None
 
 
+# ============================================================================
+# SHARED PAGE CACHE
+# ============================================================================
+
+class DirectoryPageCache:
+    """Page cache in a directory shared between operators
+    
+    ``refs/<module>/<doc>/<page>.<format>`` holds the SHA-256 of a page and
+    ``objects/<sha256>`` its bytes. Object modification times track LRU order.
+    """
+    
+    def __init__(self, root, max_bytes=None):
+        self.root = Path(root)
+        self.max_bytes = Config.SHARED_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        # Running size estimate; rescanned periodically to include other operators' writes
+        self._estimated_size = None
+        self._puts_since_scan = 0
+    
+    def _ref_path(self, module_name, doc, page, image_format):
+        return self.root / "refs" / module_name / doc / f"{page}.{image_format}"
+    
+    def _object_path(self, digest):
+        return self.root / "objects" / digest
+    
+    @staticmethod
+    def _write_atomic(path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    
+    def get(self, module_name, doc, page, image_format):
+        """Return validated page bytes, or None on a miss"""
+        try:
+            digest = self._ref_path(module_name, doc, page, image_format).read_text().strip()
+            object_path = self._object_path(digest)
+            data = object_path.read_bytes()
+        except (OSError, ValueError):
+            return None
+        
+        if not is_valid_page(data, digest, image_format):
+            return None
+        
+        try:
+            os.utime(object_path)  # Mark as recently used
+        except OSError:
+            pass
+        return data
+    
+    def put(self, module_name, doc, page, image_format, data):
+        """Store a validated page and evict old pages over the size bound"""
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = self._object_path(digest)
+        
+        added = 0
+        if object_path.exists():
+            os.utime(object_path)
+        else:
+            self._write_atomic(object_path, data)
+            added = len(data)
+        self._write_atomic(self._ref_path(module_name, doc, page, image_format), digest.encode())
+        
+        self._puts_since_scan += 1
+        if self._estimated_size is not None:
+            self._estimated_size += added
+        
+        if (self._estimated_size is None
+                or self._estimated_size > self.max_bytes
+                or self._puts_since_scan >= Config.SHARED_CACHE_SCAN_INTERVAL):
+            self.evict()
+    
+    def evict(self):
+        """Scan the cache and delete least recently used pages over max_bytes
+        
+        Eviction goes down to 90% of the bound so the next puts do not rescan.
+        """
+        entries = []
+        for object_path in (self.root / "objects").iterdir():
+            if object_path.name.endswith(".tmp"):
+                continue
+            try:
+                stat = object_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, object_path))
+        
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, object_path in sorted(entries):
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    object_path.unlink()
+                    total -= size
+                except OSError:
+                    pass
+        # Refs left pointing at evicted objects are treated as misses
+        
+        self._estimated_size = total
+        self._puts_since_scan = 0
+    
+    def close(self):
+        pass
+
+
+class HttpPageCache:
+    """Read-only page cache served by a peer over HTTP
+    
+    Any DirectoryPageCache root exposed with ``python -m http.server`` works.
+    """
+    
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        # Separate session so RBV cookies are never sent to the peer
+        self.session = requests.Session()
+        self._retry_at = 0
+    
+    def get(self, module_name, doc, page, image_format):
+        """Return validated page bytes, or None on a miss"""
+        if time.monotonic() < self._retry_at:
+            return None
+        
+        try:
+            response = self.session.get(
+                f"{self.base_url}/refs/{module_name}/{doc}/{page}.{image_format}",
+                timeout=Config.SHARED_CACHE_TIMEOUT
+            )
+            response.raise_for_status()
+            digest = response.text.strip()
+            
+            response = self.session.get(f"{self.base_url}/objects/{digest}", timeout=Config.SHARED_CACHE_TIMEOUT)
+            response.raise_for_status()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            # Unreachable peer: go straight to the origin for a while
+            self._retry_at = time.monotonic() + Config.SHARED_CACHE_RETRY_INTERVAL
+            return None
+        except requests.exceptions.RequestException:
+            return None
+        
+        data = response.content
+        return data if is_valid_page(data, digest, image_format) else None
+    
+    def put(self, module_name, doc, page, image_format, data):
+        """Peers are read-only; pages are only cached on their side"""
+        pass
+    
+    def close(self):
+        self.session.close()
+
+
+def is_valid_page(data, digest, image_format):
+    """Check cached bytes against their hash and expected image format"""
+    return (
+        hashlib.sha256(data).hexdigest() == digest
+        and ManifestManager._detect_format(data[:12]) == image_format
+    )
+
+
+def open_page_cache(location, max_bytes=None):
+    """Open a shared page cache from a directory path or peer URL"""
+    if not location:
+        return None
+    if str(location).startswith(("http://", "https://")):
+        return HttpPageCache(location)
+    return DirectoryPageCache(location, max_bytes)
+
+
 # ============================================================================
 # DOWNLOAD OPERATIONS
 # ============================================================================
@@ -416,36 +751,62 @@ def is_text_file(filepath):
     """Check if file is plain text (possible HTML error response)"""
     try:
         with open(filepath, 'rb') as f:
-            content = f.read(1024)  # Read first 1KB
-            
-            # Check for common HTML/text signatures
-            if b'<!DOCTYPE' in content or b'<html' in content or b'<HTML' in content:
-                return True
-            if b'<?xml' in content:
-                return True
-            if b'<?php' in content:
-                return True
-            # Check if content is mostly printable ASCII (likely text)
-            try:
-                content.decode('utf-8')
-                # If it decodes as UTF-8 and starts with text markers, likely text
-                if any(marker in content[:200] for marker in [b'login', b'error', b'unauthorized', b'expired']):
-                    return True
-            except:
-                pass
-        return False
+            return is_text_content(f.read(1024))  # Read first 1KB
     except:
         return False
 
 
-def fetch_image(module_name, submodule, page, output_dir, session, manifest_mgr, filename_padded):
-    """Fetch a single image using the session with original doc/page names"""
+def is_text_content(content):
+    """Check if response bytes are plain text (possible HTML error response)"""
+    content = content[:1024]
+    
+    # Check for common HTML/text signatures
+    if b'<!DOCTYPE' in content or b'<html' in content or b'<HTML' in content:
+        return True
+    if b'<?xml' in content:
+        return True
+    if b'<?php' in content:
+        return True
+    # Check if content is mostly printable ASCII (likely text)
+    try:
+        content.decode('utf-8')
+        # If it decodes as UTF-8 and starts with text markers, likely text
+        if any(marker in content[:200] for marker in [b'login', b'error', b'unauthorized', b'expired']):
+            return True
+    except:
+        pass
+    return False
+
+
+def get_total_size(response, offset=0):
+    """Get full body size from Content-Range or Content-Length"""
+    content_range = response.headers.get('content-range', '')
+    if '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        if total.isdigit():
+            return int(total)
+    
+    content_length = response.headers.get('content-length', '')
+    if content_length.isdigit():
+        return offset + int(content_length)
+    
+    return None
+
+
+def fetch_image(module_name, submodule, page, output_dir, session, manifest_mgr, filename_padded,
+                page_cache=None):
+    """Fetch a single image using the session with original doc/page names
+    
+    When a shared ``page_cache`` is given it is consulted before the origin
+    server and filled with pages downloaded from it.
+    """
     # Use original names for the request
     doc_original = f"M{submodule}"
+    source_format = manifest_mgr.get_source_format()
     
     params = {
         'doc': doc_original,
-        'format': Config.IMAGE_FORMAT,
+        'format': source_format,
         'subfolder': f'{module_name}/',
         'page': page
     }
@@ -461,31 +822,100 @@ def fetch_image(module_name, submodule, page, output_dir, session, manifest_mgr,
         'sec-fetch-dest': 'image',
         'sec-fetch-mode': 'no-cors',
         'sec-fetch-site': 'same-origin',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36 Edg/141.0.0.0'
+        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36 Edg/141.0.0.0',
+        # Byte offsets for Range resume must match the bytes written to disk
+        'accept-encoding': 'identity'
     }
     
-    filepath = output_dir / filename_padded
+    filepath = output_dir / manifest_mgr.get_source_filename(filename_padded)
+    part_path = filepath.with_name(filepath.name + Config.PART_SUFFIX)
     
-    try:
-        response = session.get(Config.BASE_URL, params=params, headers=headers, timeout=Config.TIMEOUT)
-        response.raise_for_status()
+    if page_cache is not None:
+        data = page_cache.get(module_name, doc_original, page, source_format)
+        manifest_mgr.record_cache_lookup(filename_padded, hit=data is not None, size=len(data or b""))
         
-        # Check content-type for actual format
-        content_type = response.headers.get('content-type', '').lower()
-        actual_format = None
+        if data is not None:
+            with open(part_path, 'wb') as f:
+                f.write(data)
+            os.replace(part_path, filepath)
+            
+            manifest_mgr.update_file_status(
+                filename_padded,
+                DownloadStatus.COMPLETED,
+                size=len(data),
+                actual_format=source_format
+            )
+            print(f"✓ From shared cache: {filepath.name} ({len(data):,} bytes)")
+            return "cache_hit"
+    
+    # Resume a partial body only when we can validate it with If-Range
+    resume_from = part_path.stat().st_size if part_path.exists() else 0
+    validator = manifest_mgr.manifest_data["files"].get(filename_padded, {}).get("validator")
+    if resume_from and validator:
+        headers['range'] = f'bytes={resume_from}-'
+        headers['if-range'] = validator
+        print(f"  Resuming {filename_padded} from byte {resume_from:,}")
+    
+    try:
+        response = session.get(Config.BASE_URL, params=params, headers=headers,
+                               timeout=Config.TIMEOUT, stream=True)
+        if response.status_code == 416 and 'range' in headers:
+            # Stored part no longer matches the server copy; fetch the full page
+            print(f"  Partial data for {filename_padded} rejected, fetching full page")
+            response.close()
+            part_path.unlink(missing_ok=True)
+            del headers['range'], headers['if-range']
+            response = session.get(Config.BASE_URL, params=params, headers=headers,
+                                   timeout=Config.TIMEOUT, stream=True)
         
-        if 'image/jpeg' in content_type or 'image/jpg' in content_type:
-            actual_format = 'jpg'
-        elif 'image/png' in content_type:
-            actual_format = 'png'
-        elif 'image/gif' in content_type:
-            actual_format = 'gif'
-        elif 'image/webp' in content_type:
-            actual_format = 'webp'
+        with response:
+            response.raise_for_status()
+            
+            # 206 continues the part; 200 means the range was ignored or the page changed
+            if response.status_code == 206:
+                mode, downloaded = 'ab', resume_from
+            else:
+                mode, downloaded = 'wb', 0
+            
+            total_size = get_total_size(response, downloaded)
+            manifest_mgr.update_file_progress(
+                filename_padded,
+                downloaded,
+                total_size,
+                validator=response.headers.get('etag') or response.headers.get('last-modified')
+            )
+            
+            # Check content-type for actual format
+            content_type = response.headers.get('content-type', '').lower()
+            actual_format = None
+            
+            if 'image/jpeg' in content_type or 'image/jpg' in content_type:
+                actual_format = 'jpg'
+            elif 'image/png' in content_type:
+                actual_format = 'png'
+            elif 'image/gif' in content_type:
+                actual_format = 'gif'
+            elif 'image/webp' in content_type:
+                actual_format = 'webp'
+            
+            # Stream body into the part file; the part size is the source of truth,
+            # the manifest is only refreshed periodically for progress reporting
+            last_save = time.monotonic()
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=Config.CHUNK_SIZE):
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    
+                    if time.monotonic() - last_save >= Config.PROGRESS_SAVE_INTERVAL:
+                        manifest_mgr.update_file_progress(filename_padded, downloaded, total_size)
+                        last_save = time.monotonic()
+            
+            if total_size and downloaded < total_size:
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"Connection closed after {downloaded:,} of {total_size:,} bytes"
+                )
         
-        # Save file
-        with open(filepath, 'wb') as f:
-            f.write(response.content)
+        os.replace(part_path, filepath)
         
         # Check if file is actually text (HTML error, etc.) - usually means expired cookie
         if is_text_file(filepath):
@@ -504,11 +934,11 @@ def fetch_image(module_name, submodule, page, output_dir, session, manifest_mgr,
         if detected_format:
             actual_format = detected_format
         
-        file_size = len(response.content)
+        file_size = downloaded
         
         # Check for format mismatch
-        if actual_format and actual_format.lower() != Config.IMAGE_FORMAT.lower():
-            print(f"⚠ Format mismatch: {filename_padded} - expected {Config.IMAGE_FORMAT}, got {actual_format}")
+        if actual_format and actual_format.lower() != source_format.lower():
+            print(f"⚠ Format mismatch: {filename_padded} - expected {source_format}, got {actual_format}")
             manifest_mgr.update_file_status(
                 filename_padded,
                 DownloadStatus.FORMAT_MISMATCH,
@@ -521,19 +951,178 @@ def fetch_image(module_name, submodule, page, output_dir, session, manifest_mgr,
             filename_padded,
             DownloadStatus.COMPLETED,
             size=file_size,
-            actual_format=actual_format or Config.IMAGE_FORMAT
+            actual_format=actual_format or source_format
         )
         
-        print(f"✓ Downloaded: {filename_padded} ({file_size:,} bytes)")
+        if page_cache is not None:
+            try:
+                page_cache.put(module_name, doc_original, page, source_format, filepath.read_bytes())
+            except OSError as e:
+                print(f"  ⚠ Could not store {filepath.name} in shared cache: {e}")
+        
+        print(f"✓ Downloaded: {filepath.name} ({file_size:,} bytes)")
         return "success"
     
     except requests.exceptions.RequestException as e:
         error_msg = str(e)
+        if part_path.exists():
+            manifest_mgr.update_file_progress(filename_padded, part_path.stat().st_size)
         manifest_mgr.update_file_status(filename_padded, DownloadStatus.FAILED, error=error_msg)
         print(f"✗ Failed to download {filename_padded}: {e}")
         return "failed"
 
 
+def negotiate_format(module_name, session, manifest_mgr, delay_range=None):
+    """Probe which formats the server offers and pick the smallest
+    
+    Probe results are only kept once every candidate got a definite answer,
+    so failed probes (network errors, expired cookies) are retried next run.
+    """
+    min_delay, max_delay = delay_range or (Config.MIN_DELAY, Config.MAX_DELAY)
+    print("\nProbing server image formats...")
+    
+    metadata = manifest_mgr.manifest_data["metadata"]
+    first_doc = sorted(metadata["docs_info"].keys())[0]
+    
+    headers = {
+        'accept': 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8',
+        'referer': f'{Config.REFERER_BASE}?subfolder={module_name}/&doc={first_doc}.pdf',
+        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Safari/537.36 Edg/141.0.0.0'
+    }
+    
+    probe_sizes = {}
+    probe_failed = False
+    for idx, image_format in enumerate(Config.CANDIDATE_FORMATS):
+        # Same pacing as regular page requests
+        if idx > 0:
+            delay = random.uniform(min_delay, max_delay)
+            print(f"  Waiting {delay:.1f} seconds before next probe...")
+            time.sleep(delay)
+        
+        params = {
+            'doc': first_doc,
+            'format': image_format,
+            'subfolder': f'{module_name}/',
+            'page': 1
+        }
+        
+        try:
+            response = session.get(Config.BASE_URL, params=params, headers=headers, timeout=Config.TIMEOUT)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"  {image_format}: probe failed ({e})")
+            probe_sizes[image_format] = None
+            probe_failed = True
+            continue
+        
+        if is_text_content(response.content):
+            print(f"  {image_format}: probe failed (received text/HTML - likely expired cookies)")
+            probe_sizes[image_format] = None
+            probe_failed = True
+            continue
+        
+        # Only count formats the server really serves, not a silent fallback
+        if ManifestManager._detect_format(response.content[:12]) == image_format:
+            probe_sizes[image_format] = len(response.content)
+            print(f"  {image_format}: {len(response.content):,} bytes")
+        else:
+            probe_sizes[image_format] = None
+            print(f"  {image_format}: not supported")
+    
+    supported = {fmt: size for fmt, size in probe_sizes.items() if size}
+    if not supported:
+        source_format = manifest_mgr.get_source_format()
+        print(f"⚠ No format confirmed; fetching {source_format.upper()} and probing again next run")
+        return source_format
+    
+    source_format = min(supported, key=supported.get)
+    manifest_mgr.set_source_format(source_format, None if probe_failed else probe_sizes)
+    if probe_failed:
+        print("⚠ Some probes failed; formats will be probed again next run")
+    print(f"✓ Fetching pages as {source_format.upper()}")
+    return source_format
+
+
+class Transcoder:
+    """Convert fetched pages to Config.IMAGE_FORMAT in a background thread pool"""
+    
+    def __init__(self, manifest_mgr, output_dir, workers=None):
+        self.manifest_mgr = manifest_mgr
+        self.output_dir = Path(output_dir)
+        self.executor = ThreadPoolExecutor(max_workers=workers or Config.TRANSCODE_WORKERS)
+        self.futures = []
+    
+    def submit(self, filename):
+        """Queue one completed page for conversion"""
+        self.futures.append(self.executor.submit(self._transcode, filename))
+    
+    def submit_pending(self):
+        """Queue every completed page not yet converted"""
+        for filename in self.manifest_mgr.get_untranscoded_files():
+            self.submit(filename)
+    
+    def _transcode(self, filename):
+        from PIL import Image
+        
+        source_path = self.output_dir / self.manifest_mgr.get_source_filename(filename)
+        target_path = self.output_dir / filename
+        temp_path = target_path.with_name(target_path.name + ".tmp")
+        
+        with Image.open(source_path) as img:
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            img.save(temp_path, PIL_FORMATS[Config.IMAGE_FORMAT], quality=Config.TRANSCODE_QUALITY)
+        
+        os.replace(temp_path, target_path)
+        self.manifest_mgr.mark_transcoded(filename)
+    
+    def close(self):
+        """Wait for queued conversions; return the number that failed"""
+        failures = 0
+        for future in self.futures:
+            try:
+                future.result()
+            except Exception as e:
+                failures += 1
+                print(f"  ⚠ Transcode failed: {e}")
+        
+        self.executor.shutdown()
+        self.futures = []
+        return failures
+
+
+def prepare_transcoder(module_name, session, manifest_mgr, output_dir, negotiate=None, delay_range=None):
+    """Negotiate the fetch format if enabled and start a transcoder when needed"""
+    negotiate = Config.NEGOTIATE_FORMAT if negotiate is None else negotiate
+    format_probe = manifest_mgr.manifest_data["metadata"].get("format_probe") or {}
+    # Probe unless an earlier probe confirmed at least one format
+    if negotiate and not any(format_probe.values()):
+        negotiate_format(module_name, session, manifest_mgr, delay_range)
+    
+    if not manifest_mgr.needs_transcode() and not manifest_mgr.get_untranscoded_files():
+        return None
+    
+    transcoder = Transcoder(manifest_mgr, output_dir)
+    transcoder.submit_pending()
+    return transcoder
+
+
+def create_session(cookies=None):
+    """Create a pooled session carrying the RBV cookies"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=Config.POOL_SIZE,
+        pool_maxsize=Config.POOL_SIZE
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    
+    for cookie_name, cookie_value in (cookies if cookies is not None else Config.COOKIES).items():
+        session.cookies.set(cookie_name, cookie_value)
+    
+    return session
+
+
 def test_first_file(module_name, session, manifest_mgr):
     """Test download of first file to verify connectivity"""
     print("\nTesting first file download...")
@@ -544,7 +1133,7 @@ def test_first_file(module_name, session, manifest_mgr):
     
     params = {
         'doc': first_doc,
-        'format': Config.IMAGE_FORMAT,
+        'format': manifest_mgr.get_source_format(),
         'subfolder': f'{module_name}/',
         'page': 1
     }
@@ -588,7 +1177,10 @@ def run_download(module_name, docs_pages, resume_manifest=None):
     print(f"Module: {module_name}")
     print(f"Documents: {metadata['num_docs']}")
     print(f"Total pages: {metadata['total_pages']}")
-    print(f"Expected format: {Config.IMAGE_FORMAT.upper()}")
+    if manifest_mgr.needs_transcode():
+        print(f"Format: {manifest_mgr.get_source_format().upper()} (transcoded to {Config.IMAGE_FORMAT.upper()})")
+    else:
+        print(f"Expected format: {Config.IMAGE_FORMAT.upper()}")
     
     progress = manifest_mgr.get_download_progress()
     if progress > 0:
@@ -603,9 +1195,9 @@ def run_download(module_name, docs_pages, resume_manifest=None):
         return False
     
     # Create session with all cookies
-    session = requests.Session()
-    for cookie_name, cookie_value in Config.COOKIES.items():
-        session.cookies.set(cookie_name, cookie_value)
+    session = create_session()
+    transcoder = prepare_transcoder(module_name, session, manifest_mgr, output_dir)
+    page_cache = open_page_cache(Config.SHARED_CACHE)
     
     # Get list of files to download
     pending_files = manifest_mgr.get_pending_files()
@@ -627,9 +1219,12 @@ def run_download(module_name, docs_pages, resume_manifest=None):
             current_total = completed_files + idx
             print(f"[{current_total}/{total_files}] Fetching {filename}...")
             
-            result = fetch_image(module_name, submodule, pagenumber, output_dir, session, manifest_mgr, filename)
+            result = fetch_image(module_name, submodule, pagenumber, output_dir, session, manifest_mgr, filename,
+                                 page_cache=page_cache)
             
-            if result == "cookie_expired":
+            if result in ("success", "cache_hit") and transcoder:
+                transcoder.submit(filename)
+            elif result == "cookie_expired":
                 print("\n" + "=" * 70)
                 print("⚠ COOKIE EXPIRATION DETECTED")
                 print("=" * 70)
@@ -656,8 +1251,8 @@ def run_download(module_name, docs_pages, resume_manifest=None):
                     interrupted = True
                     break
             
-            # Random delay between requests
-            if idx < len(pending_files):
+            # Random delay between requests (cache hits never reached the server)
+            if idx < len(pending_files) and result != "cache_hit":
                 delay = random.uniform(Config.MIN_DELAY, Config.MAX_DELAY)
                 print(f"Waiting {delay:.1f} seconds before next request...")
                 time.sleep(delay)
@@ -667,10 +1262,19 @@ def run_download(module_name, docs_pages, resume_manifest=None):
         interrupted = True
     finally:
         session.close()
+        if transcoder:
+            transcoder.close()
+        if page_cache is not None:
+            page_cache.close()
         
         final_progress = manifest_mgr.get_download_progress()
         print(f"\nCurrent progress: {final_progress:.1f}%")
         
+        cache_stats = manifest_mgr.manifest_data["metadata"].get("cache_stats")
+        if page_cache is not None and cache_stats:
+            print(f"Shared cache: {cache_stats['hits']} hit(s), {cache_stats['misses']} miss(es), "
+                  f"{cache_stats['bytes_from_cache']:,} bytes served from cache")
+        
         if manifest_mgr.is_download_complete():
             print(f"✓ All files downloaded successfully!")
             return True
@@ -680,11 +1284,249 @@ def run_download(module_name, docs_pages, resume_manifest=None):
             return False
 
 
+# ============================================================================
+# PAGE ANALYSIS
+# ============================================================================
+
+def analyze_batch(pixels, sizes):
+    """Flag blank pages and find content boxes for a batch of grayscale pages
+    
+    ``pixels`` is an (N, H, W) uint8 array of downsampled pages and ``sizes``
+    an (N, 2) array of their original (width, height).
+    """
+    import numpy as np
+    
+    ink = pixels < Config.INK_THRESHOLD
+    ink_ratio = ink.mean(axis=(1, 2))
+    blank = ink_ratio < Config.BLANK_INK_RATIO
+    
+    # Rows/columns need several dark pixels so dust specks do not count as content
+    rows = ink.sum(axis=2) >= Config.CROP_MIN_PIXELS
+    cols = ink.sum(axis=1) >= Config.CROP_MIN_PIXELS
+    has_content = rows.any(axis=1) & cols.any(axis=1) & ~blank
+    
+    height, width = pixels.shape[1:]
+    top = rows.argmax(axis=1) / height
+    bottom = (height - rows[:, ::-1].argmax(axis=1)) / height
+    left = cols.argmax(axis=1) / width
+    right = (width - cols[:, ::-1].argmax(axis=1)) / width
+    
+    # Pad, clip and scale the normalized boxes back to original pixels
+    boxes = np.stack([left, top, right, bottom], axis=1)
+    boxes += np.array([-1, -1, 1, 1]) * Config.CROP_MARGIN
+    boxes = np.clip(boxes, 0, 1) * np.tile(sizes, 2)
+    boxes = np.rint(boxes).astype(int)
+    
+    return [
+        {
+            "blank": bool(blank[i]),
+            "ink_ratio": round(float(ink_ratio[i]), 5),
+            "image_size": [int(v) for v in sizes[i]],
+            "crop_box": [int(v) for v in boxes[i]] if has_content[i] else None
+        }
+        for i in range(len(pixels))
+    ]
+
+
+def analyze_pages(module_name, output_dir=None, manifest_mgr=None, force=False):
+    """Analyze completed pages in batches and store results in the manifest"""
+    try:
+        import numpy as np
+        from PIL import Image
+    except ImportError:
+        print("\n✗ NumPy and Pillow are required for page analysis. Install with: pip install numpy Pillow")
+        return False
+    
+    output_dir = Path(output_dir) if output_dir is not None else Path(module_name)
+    if manifest_mgr is None:
+        manifest_mgr = ManifestManager(module_name, output_dir)
+        if not manifest_mgr.load_manifest():
+            print("✗ No manifest found for analysis.")
+            return False
+    
+    if force:
+        filenames = [
+            fname for fname, info in manifest_mgr.manifest_data["files"].items()
+            if info["status"] == DownloadStatus.COMPLETED.value
+        ]
+    else:
+        filenames = manifest_mgr.get_unanalyzed_files()
+    
+    if not filenames:
+        return True
+    
+    print(f"\nAnalyzing {len(filenames)} page(s)...")
+    
+    batch_size = Config.ANALYSIS_BATCH_SIZE
+    for start in range(0, len(filenames), batch_size):
+        batch_names, pixels, sizes = [], [], []
+        
+        for filename in filenames[start:start + batch_size]:
+            filepath = output_dir / filename
+            if not filepath.exists():
+                filepath = output_dir / manifest_mgr.get_source_filename(filename)
+            
+            try:
+                with Image.open(filepath) as img:
+                    sizes.append(img.size)
+                    # Let the JPEG decoder downscale while reading
+                    img.draft('L', Config.ANALYSIS_SIZE)
+                    small = img.convert('L').resize(Config.ANALYSIS_SIZE)
+                pixels.append(np.asarray(small))
+                batch_names.append(filename)
+            except Exception as e:
+                print(f"  ⚠ Could not analyze {filename}: {e}")
+        
+        if not batch_names:
+            continue
+        
+        results = analyze_batch(np.stack(pixels), np.array(sizes))
+        manifest_mgr.set_analysis(dict(zip(batch_names, results)))
+        
+        blank_count = sum(result["blank"] for result in results)
+        print(f"  Analyzed {start + len(batch_names)}/{len(filenames)} ({blank_count} blank in batch)")
+    
+    return True
+
+
 # ============================================================================
 # PDF GENERATION
 # ============================================================================
 
-def combine_to_pdf(module_name):
+class PdfStreamWriter:
+    """Write a PDF one page at a time, embedding JPEG data without re-encoding"""
+    
+    CATALOG_ID = 1
+    PAGES_ID = 2
+    
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = 3
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    
+    def _new_id(self):
+        obj_id = self.next_id
+        self.next_id += 1
+        return obj_id
+    
+    def _write_object(self, obj_id, body, stream=None):
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write(f"{obj_id} 0 obj\n{body}\n".encode())
+        if stream is not None:
+            self.file.write(b"stream\n")
+            self.file.write(stream)
+            self.file.write(b"\nendstream\n")
+        self.file.write(b"endobj\n")
+    
+    def add_jpeg_page(self, jpeg_data, width, height, color_space, crop_box=None):
+        """Append a page showing one JPEG at 72 dpi
+        
+        ``crop_box`` is an optional (left, top, right, bottom) pixel box; the
+        page is cropped through its MediaBox so the image is not re-encoded.
+        """
+        image_id, content_id, page_id = self._new_id(), self._new_id(), self._new_id()
+        
+        self._write_object(
+            image_id,
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+            f"/ColorSpace /{color_space} /BitsPerComponent 8 /Filter /DCTDecode "
+            f"/Length {len(jpeg_data)} >>",
+            jpeg_data
+        )
+        
+        content = f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode()
+        self._write_object(content_id, f"<< /Length {len(content)} >>", content)
+        
+        # PDF coordinates start at the bottom-left corner
+        left, top, right, bottom = crop_box or (0, 0, width, height)
+        media_box = f"[{left} {height - bottom} {right} {height - top}]"
+        
+        self._write_object(
+            page_id,
+            f"<< /Type /Page /Parent {self.PAGES_ID} 0 R /MediaBox {media_box} "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R >>"
+        )
+        self.page_ids.append(page_id)
+    
+    def close(self):
+        """Write the page tree, catalog and cross-reference table"""
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._write_object(self.PAGES_ID, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>")
+        self._write_object(self.CATALOG_ID, f"<< /Type /Catalog /Pages {self.PAGES_ID} 0 R >>")
+        
+        xref_offset = self.file.tell()
+        self.file.write(f"xref\n0 {self.next_id}\n0000000000 65535 f \n".encode())
+        for obj_id in range(1, self.next_id):
+            self.file.write(f"{self.offsets[obj_id]:010d} 00000 n \n".encode())
+        self.file.write(
+            f"trailer\n<< /Size {self.next_id} /Root {self.CATALOG_ID} 0 R >>\n"
+            f"startxref\n{xref_offset}\n%%EOF\n".encode()
+        )
+        self.file.close()
+
+
+def load_pdf_page(image_path, crop_box=None):
+    """Get JPEG bytes, size and color space for a page, re-encoding only if needed
+    
+    Passing ``crop_box`` crops the image data itself, which always re-encodes.
+    """
+    from PIL import Image
+    
+    with Image.open(image_path) as img:
+        if img.format == 'JPEG' and img.mode in ('RGB', 'L') and crop_box is None:
+            with open(image_path, 'rb') as f:
+                jpeg_data = f.read()
+        else:
+            # Cropped, non-JPEG or CMYK/palette images are converted to RGB JPEG
+            img = img.convert('L' if img.mode in ('1', 'L', 'LA') else 'RGB')
+            if crop_box is not None:
+                img = img.crop(tuple(crop_box))
+            buffer = io.BytesIO()
+            img.save(buffer, 'JPEG', quality=Config.TRANSCODE_QUALITY)
+            jpeg_data = buffer.getvalue()
+        
+        color_space = 'DeviceGray' if img.mode == 'L' else 'DeviceRGB'
+        return jpeg_data, img.width, img.height, color_space
+
+
+def linearize_pdf(pdf_path):
+    """Rewrite a PDF linearized with compressed object and xref streams"""
+    try:
+        import pikepdf
+    except ImportError:
+        print("⚠ pikepdf not installed, PDF left unlinearized. Install with: pip install pikepdf")
+        return False
+    
+    temp_path = pdf_path.with_name(pdf_path.name + ".linearized")
+    try:
+        with pikepdf.open(pdf_path) as pdf:
+            pdf.save(
+                temp_path,
+                linearize=True,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                compress_streams=True
+            )
+        os.replace(temp_path, pdf_path)
+        return True
+    except Exception as e:
+        # The plain PDF is already complete; keep it and drop the partial rewrite
+        if temp_path.exists():
+            temp_path.unlink()
+        print(f"⚠ Could not linearize PDF, keeping unlinearized file: {e}")
+        return False
+
+
+def crop_saving(analysis):
+    """Fraction of the page area a stored crop box removes"""
+    left, top, right, bottom = analysis["crop_box"]
+    width, height = analysis["image_size"]
+    return 1 - (right - left) * (bottom - top) / (width * height)
+
+
+def combine_to_pdf(module_name, output_dir=None, linearize=None, skip_blank=None, auto_crop=None,
+                   crop_reencode=None):
     """Combine all downloaded images into a single PDF"""
     try:
         from PIL import Image
@@ -692,7 +1534,30 @@ def combine_to_pdf(module_name):
         print("\n✗ PIL (Pillow) not installed. Install with: pip install Pillow")
         return False
     
-    output_dir = Path(module_name)
+    output_dir = Path(output_dir) if output_dir is not None else Path(module_name)
+    linearize = Config.PDF_LINEARIZE if linearize is None else linearize
+    skip_blank = Config.PDF_SKIP_BLANK if skip_blank is None else skip_blank
+    auto_crop = Config.PDF_AUTO_CROP if auto_crop is None else auto_crop
+    crop_reencode = Config.PDF_CROP_REENCODE if crop_reencode is None else crop_reencode
+    
+    # Finish converting any pages fetched in another format
+    manifest_mgr = ManifestManager(module_name, output_dir)
+    has_manifest = manifest_mgr.load_manifest() is not None
+    if has_manifest and manifest_mgr.get_untranscoded_files():
+        print("\nTranscoding remaining pages...")
+        transcoder = Transcoder(manifest_mgr, output_dir)
+        transcoder.submit_pending()
+        transcoder.close()
+    
+    # Reuse stored analysis; only pages never analyzed are loaded again
+    page_analysis = {}
+    if has_manifest and (skip_blank or auto_crop):
+        analyze_pages(module_name, output_dir, manifest_mgr)
+        page_analysis = {
+            fname: info["analysis"]
+            for fname, info in manifest_mgr.manifest_data["files"].items()
+            if "analysis" in info
+        }
     
     # Get all JPG files in order (sorted by filename which includes padding)
     jpg_files = sorted(output_dir.glob(f"*.{Config.IMAGE_FORMAT}"))
@@ -703,33 +1568,43 @@ def combine_to_pdf(module_name):
     
     print(f"\nCombining {len(jpg_files)} images into PDF...")
     
+    pdf_filename = f"{module_name}.pdf"
+    pdf_path = output_dir / pdf_filename
+    temp_path = pdf_path.with_name(pdf_filename + ".tmp")
+    
     try:
-        images = []
-        for jpg_file in jpg_files:
-            try:
-                img = Image.open(jpg_file)
-                # Convert CMYK to RGB if necessary
-                if img.mode in ('CMYK', 'P'):
-                    img = img.convert('RGB')
-                images.append(img)
-                print(f"  Added: {jpg_file.name}")
-            except Exception as e:
-                print(f"  ⚠ Skipped {jpg_file.name}: {e}")
+        # Pages are streamed to disk one at a time to keep memory flat
+        writer = PdfStreamWriter(temp_path)
+        try:
+            for jpg_file in jpg_files:
+                analysis = page_analysis.get(jpg_file.name, {})
+                if skip_blank and analysis.get("blank"):
+                    print(f"  Skipped blank page: {jpg_file.name}")
+                    continue
+                
+                crop_box = analysis.get("crop_box") if auto_crop else None
+                try:
+                    # Large crops may re-encode to drop margin pixels; others only set the page box
+                    if crop_box and crop_reencode and crop_saving(analysis) >= Config.CROP_REENCODE_MIN_AREA:
+                        writer.add_jpeg_page(*load_pdf_page(jpg_file, crop_box=crop_box))
+                    else:
+                        writer.add_jpeg_page(*load_pdf_page(jpg_file), crop_box=crop_box)
+                    print(f"  Added: {jpg_file.name}")
+                except Exception as e:
+                    print(f"  ⚠ Skipped {jpg_file.name}: {e}")
+        finally:
+            writer.close()
         
-        if not images:
+        if not writer.page_ids:
+            temp_path.unlink()
             print("✗ No valid images to combine.")
             return False
         
-        pdf_filename = f"{module_name}.pdf"
-        pdf_path = output_dir / pdf_filename
+        os.replace(temp_path, pdf_path)
         
-        images[0].save(
-            pdf_path,
-            "PDF",
-            save_all=True,
-            append_images=images[1:],
-            optimize=False
-        )
+        if linearize:
+            print("Linearizing PDF for fast web view...")
+            linearize_pdf(pdf_path)
         
         print(f"\n✓ PDF created successfully: {pdf_path.absolute()}")
         return True
@@ -739,6 +1614,185 @@ def combine_to_pdf(module_name):
         return False
 
 
+# ============================================================================
+# LIBRARY API
+# ============================================================================
+
+PageResult = namedtuple(
+    "PageResult",
+    ["filename", "submodule", "page", "result", "status", "size", "progress"]
+)
+
+
+class Downloader:
+    """Non-interactive downloader for embedding in other programs
+    
+    Pass the same ``session`` to several downloaders to share one
+    connection pool across modules in a long-lived process. Progress
+    callbacks run on the thread iterating the pages; with ``async for``
+    that is the event-loop thread.
+    """
+    
+    def __init__(self, module_name, docs_pages=None, cookies=None, session=None,
+                 output_root=".", min_delay=None, max_delay=None,
+                 on_progress=None, stop_on_cookie_expired=True, negotiate_format=None,
+                 page_cache=None):
+        self.module_name = module_name
+        self.output_dir = Path(output_root) / module_name
+        self.min_delay = Config.MIN_DELAY if min_delay is None else min_delay
+        self.max_delay = Config.MAX_DELAY if max_delay is None else max_delay
+        self.stop_on_cookie_expired = stop_on_cookie_expired
+        self.negotiate_format = negotiate_format
+        self._owns_page_cache = page_cache is None
+        self.page_cache = page_cache if page_cache is not None else open_page_cache(Config.SHARED_CACHE)
+        self.transcoder = None
+        self.callbacks = [on_progress] if on_progress else []
+        
+        self.manifest_mgr = ManifestManager(module_name, self.output_dir)
+        if self.manifest_mgr.load_manifest() is None:
+            if not docs_pages:
+                raise ValueError(f"No manifest found for {module_name}; docs_pages is required")
+            self.manifest_mgr.create_manifest(docs_pages)
+        
+        self._owns_session = session is None
+        self.session = session if session is not None else create_session(cookies)
+    
+    def add_progress_callback(self, callback):
+        """Register a callable invoked with each PageResult"""
+        self.callbacks.append(callback)
+    
+    def _fetch(self, filename):
+        """Download one manifest entry and build its PageResult"""
+        submodule, pagenumber = self.manifest_mgr.get_file_info_for_download(filename)
+        if submodule is None or pagenumber is None:
+            return None
+        
+        result = fetch_image(
+            self.module_name, submodule, pagenumber, self.output_dir,
+            self.session, self.manifest_mgr, filename, page_cache=self.page_cache
+        )
+        if result in ("success", "cache_hit") and self.transcoder:
+            self.transcoder.submit(filename)
+        file_info = self.manifest_mgr.manifest_data["files"][filename]
+        page_result = PageResult(
+            filename=filename,
+            submodule=submodule,
+            page=pagenumber,
+            result=result,
+            status=file_info["status"],
+            size=file_info["size"],
+            progress=self.manifest_mgr.get_download_progress()
+        )
+        return page_result
+    
+    def _notify(self, page_result):
+        for callback in self.callbacks:
+            callback(page_result)
+    
+    def _should_stop(self, page_result):
+        return self.stop_on_cookie_expired and page_result.result == "cookie_expired"
+    
+    def _delay(self):
+        return random.uniform(self.min_delay, self.max_delay)
+    
+    def _start(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.transcoder = prepare_transcoder(
+            self.module_name, self.session, self.manifest_mgr, self.output_dir,
+            negotiate=self.negotiate_format, delay_range=(self.min_delay, self.max_delay)
+        )
+        return self.manifest_mgr.get_pending_files()
+    
+    def _finish(self):
+        if self.transcoder:
+            self.transcoder.close()
+            self.transcoder = None
+    
+    def iter_pages(self):
+        """Download pending pages, yielding a PageResult for each"""
+        pending_files = self._start()
+        
+        try:
+            for idx, filename in enumerate(pending_files, 1):
+                page_result = self._fetch(filename)
+                if page_result is None:
+                    continue
+                
+                self._notify(page_result)
+                yield page_result
+                if self._should_stop(page_result):
+                    return
+                
+                if idx < len(pending_files) and page_result.result != "cache_hit":
+                    time.sleep(self._delay())
+        finally:
+            self._finish()
+    
+    async def aiter_pages(self):
+        """Async variant of iter_pages; blocking I/O runs in an executor"""
+        loop = asyncio.get_running_loop()
+        pending_files = await loop.run_in_executor(None, self._start)
+        
+        try:
+            for idx, filename in enumerate(pending_files, 1):
+                page_result = await loop.run_in_executor(None, self._fetch, filename)
+                if page_result is None:
+                    continue
+                
+                # Back on the loop thread, so callbacks may use loop objects
+                self._notify(page_result)
+                yield page_result
+                if self._should_stop(page_result):
+                    return
+                
+                if idx < len(pending_files) and page_result.result != "cache_hit":
+                    await asyncio.sleep(self._delay())
+        finally:
+            await loop.run_in_executor(None, self._finish)
+    
+    def __iter__(self):
+        return self.iter_pages()
+    
+    def __aiter__(self):
+        return self.aiter_pages()
+    
+    def run(self):
+        """Download every pending page; return True when the module is complete"""
+        for _ in self.iter_pages():
+            pass
+        return self.manifest_mgr.is_download_complete()
+    
+    async def run_async(self):
+        """Async variant of run"""
+        async for _ in self.aiter_pages():
+            pass
+        return self.manifest_mgr.is_download_complete()
+    
+    def analyze_pages(self, force=False):
+        """Flag blank pages and compute crop boxes for downloaded pages"""
+        return analyze_pages(self.module_name, self.output_dir, self.manifest_mgr, force=force)
+    
+    def combine_to_pdf(self, linearize=None, skip_blank=None, auto_crop=None, crop_reencode=None):
+        """Combine this module's pages into a PDF"""
+        return combine_to_pdf(
+            self.module_name, output_dir=self.output_dir, linearize=linearize,
+            skip_blank=skip_blank, auto_crop=auto_crop, crop_reencode=crop_reencode
+        )
+    
+    def close(self):
+        """Close the session and page cache if this downloader created them"""
+        if self._owns_session:
+            self.session.close()
+        if self._owns_page_cache and self.page_cache is not None:
+            self.page_cache.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
 # ============================================================================
 # MAIN EXECUTION
 # ============================================================================